@@ -1,16 +1,101 @@
 import os
 import asyncio
+import hashlib
+import json
+import math
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import List, Dict, Optional
+from urllib.parse import urlsplit
+from typing import Callable, Deque, List, Dict, Optional
+import aiofiles
+import aiohttp
+import numpy as np
 from dotenv import load_dotenv
-from azure.ai.inference import ChatCompletionsClient
+from azure.ai.inference.aio import ChatCompletionsClient, EmbeddingsClient
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseTimeoutError
+from azure.core.pipeline.transport import AioHttpTransport
+from openai import AsyncAzureOpenAI
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+# HTTP statuses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+def _is_transient_error(error: BaseException) -> bool:
+    """Check whether a failed completion request is worth retrying.
+
+    The transport reports timeouts as azure-core errors: ServiceRequestError (including
+    ServiceRequestTimeoutError) when the request could not be sent, and
+    ServiceResponseTimeoutError when the response did not arrive in time"""
+    if isinstance(error, HttpResponseError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (ServiceRequestError, ServiceResponseTimeoutError))
+
+class SemanticCache:
+    """Caches answers by question embedding, scoped to the conversation summary they were given under."""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # context key -> (unit-normalised embeddings, one row per answer; answers)
+        self._buckets = OrderedDict()
+        self._size = 0
+
+    def lookup(self, embedding: List[float], context_key: str) -> Optional[str]:
+        """Return the cached answer closest to the embedding if it clears the similarity threshold"""
+        bucket = self._buckets.get(context_key)
+        if bucket is None:
+            return None
+        vectors, responses = bucket
+        scores = vectors @ self._normalize(embedding)  # cosine similarity against every entry
+        best = int(np.argmax(scores))
+        return responses[best] if scores[best] >= self.threshold else None
+
+    def add(self, embedding: List[float], context_key: str, response: str):
+        """Store an answer, evicting the oldest contexts once the cache is full.
+
+        When a single context holds more than max_entries answers, its oldest answers are dropped"""
+        vector = self._normalize(embedding)[np.newaxis, :]
+        vectors, responses = self._buckets.get(context_key, (None, []))
+        vectors = vector if vectors is None else np.vstack((vectors, vector))
+        self._buckets[context_key] = (vectors, responses + [response])
+        self._buckets.move_to_end(context_key)
+        self._size += 1
+
+        while self._size > self.max_entries and len(self._buckets) > 1:
+            _, (_, evicted) = self._buckets.popitem(last=False)
+            self._size -= len(evicted)
+
+        if self._size > self.max_entries:
+            vectors, responses = self._buckets[context_key]
+            self._buckets[context_key] = (vectors[-self.max_entries:], responses[-self.max_entries:])
+            self._size = self.max_entries
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
 
 class LegalAssistant:
     def __init__(self):
         load_dotenv()
         self.chat_history: List[Dict] = []
         self.chat_client = None
+        self.embeddings_client = None
+        self._http: Optional[aiohttp.ClientSession] = None
+        self.deployment = "legal-assistant"  # Azure OpenAI deployment name
+        self.max_concurrency = 8
+        self.batch_history: List[Dict] = []
+        self._batch_client: Optional[AsyncAzureOpenAI] = None
+        self.embedding_deployment = os.getenv("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+        self.cache = SemanticCache()
+        self.history_file = "chat_history.txt"
+        self._log = None
+        self._log_lock = asyncio.Lock()
         self.system_prompt = """You are an expert AI Legal Assistant specializing in artificial intelligence regulations worldwide. 
         When answering questions:
         1. Provide accurate, up-to-date information on AI laws and regulations
@@ -20,66 +105,434 @@ class LegalAssistant:
         5. Clearly state when information may require verification
         Remember to recommend consulting with legal professionals for specific legal advice."""
 
+        # Conversation memory: recent turns verbatim, older turns folded into a running summary
+        self.window_turns = 20
+        self.summarize_every = 5
+        self.summary_batch_turns = 10
+        self.summary_deployment = os.getenv("AZURE_OPENAI_SUMMARY_DEPLOYMENT", "gpt-4o-mini")
+        self.window: Deque[Dict] = deque(maxlen=2 * self.window_turns)
+        self.summary = ""
+        self._turns_since_summary = 0
+        self._summary_task: Optional[asyncio.Task] = None
+        self.summary_prompt = """You maintain the memory of a conversation with an AI Legal Assistant.
+        Merge the existing summary and the new conversation turns into one compact list of facts.
+        Always keep the user's jurisdiction, organization and use case, and every law, regulation
+        or case that was cited. Drop greetings, repetition and wording that adds no information."""
+        self._system_msg = self._build_system_message()
+
     async def initialize(self):
         """Initialize chat client"""
         try:
+            # Long-lived pooled session so every request reuses warm keep-alive connections
+            self._http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=2000))
+            # The SDK's own retry policy is switched off: completions are retried by
+            # _complete, and stacking both would multiply the attempts per request.
+            # Timeouts are set on the transports, which pass them to aiohttp with every
+            # request and so override any timeout set on the session
             self.chat_client = ChatCompletionsClient(
                 endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
                 credential=AzureKeyCredential(os.getenv("AZURE_OPENAI_KEY")),
-                api_version="2024-02-15-preview"
+                api_version="2024-02-15-preview",
+                transport=AioHttpTransport(session=self._http, session_owner=False,
+                                           connection_timeout=10, read_timeout=120),
+                retry_total=0
+            )
+            self.embeddings_client = EmbeddingsClient(
+                endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+                credential=AzureKeyCredential(os.getenv("AZURE_OPENAI_KEY")),
+                api_version="2024-02-15-preview",
+                transport=AioHttpTransport(session=self._http, session_owner=False,
+                                           connection_timeout=10, read_timeout=120),
+                retry_total=0
             )
+            # Interactions are appended as they happen, so saving only needs a flush
+            self._log = await aiofiles.open(self.history_file, "a")
+            await self._prewarm_connection()
             print("✅ Legal Assistant initialized successfully")
             return True
         except Exception as e:
             print(f"❌ Initialization error: {str(e)}")
             return False
 
-    async def get_response(self, user_input: str) -> Optional[str]:
-        """Get response from the AI assistant"""
+    async def _prewarm_connection(self):
+        """Open the TLS connection to the endpoint before the first question is asked.
+
+        The pooled session keeps the connection alive for the first real request;
+        the response itself is irrelevant, and failures only mean a cold first call"""
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        if not endpoint:
+            return
         try:
-            messages = [
-                {"role": "system", "content": self.system_prompt},
-                {"role": "user", "content": user_input}
-            ]
-            
-            # Add chat history context for continuity
-            for history in self.chat_history[-3:]:  # Include last 3 interactions for context
-                messages.append({"role": "user", "content": history["user_input"]})
-                messages.append({"role": "assistant", "content": history["assistant_response"]})
-            
-            # Get new response using the correct API
-            response = await self.chat_client.get_chat_completions(
-                model="legal-assistant",  # This is your deployment name
-                messages=messages
-            )
+            async with self._http.head(
+                endpoint,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=5)
+            ) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+
+    async def get_response(self, user_input: str,
+                           on_token: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Get response from the AI assistant.
+
+        The answer is streamed; on_token, if given, receives each piece of text as it arrives"""
+        try:
+            # Recent turns verbatim for continuity, then the new question
+            messages = [self._system_msg]
+            messages.extend(self.window)
+            messages.append({"role": "user", "content": user_input})
             
-            response_content = response.choices[0].message.content
+            # A question, or a paraphrase of it, asked again in the same context is
+            # answered from the semantic cache
+            context_key = self._context_key()
+            embedding = await self._embed(user_input)
+            response_content = self.cache.lookup(embedding, context_key) if embedding else None
+
+            if response_content is None:
+                # Stream the new response, retrying throttling and transient server errors
+                # while the stream is opened
+                chunks = []
+                async with await self._complete(messages, stream=True) as stream:
+                    async for update in stream:
+                        delta = update.choices[0].delta.content if update.choices else None
+                        if delta:
+                            chunks.append(delta)
+                            if on_token:
+                                on_token(delta)
+                response_content = "".join(chunks)
+                if embedding:
+                    self.cache.add(embedding, context_key, response_content)
+            elif on_token:
+                on_token(response_content)
             
             # Store the interaction in chat history
-            self.chat_history.append({
+            interaction = {
                 "timestamp": datetime.now().isoformat(),
                 "user_input": user_input,
                 "assistant_response": response_content
-            })
+            }
+            self.chat_history.append(interaction)
+            self._remember(user_input, response_content)
+            await self._log_interaction(interaction)
             
             return response_content
         except Exception as e:
             print(f"❌ Error getting response: {str(e)}")
             return None
 
-    def save_chat_history(self, filename: str = "chat_history.txt"):
-        """Save the chat history to a file"""
+    def _build_system_message(self) -> Dict:
+        """Build the system message sent with every chat request.
+
+        It only changes when the summary does, so consecutive requests share a
+        byte-identical prefix that the service's prompt cache can reuse"""
+        content = self.system_prompt
+        if self.summary:
+            content += f"\n\nSummary of the earlier conversation:\n{self.summary}"
+        return {"role": "system", "content": content}
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        """Embed text for the semantic cache; a failure only disables caching for this call"""
+        try:
+            response = await self.embeddings_client.embed(model=self.embedding_deployment, input=[text])
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"❌ Error embedding query: {str(e)}")
+            return None
+
+    def _context_key(self) -> str:
+        """Hash what a new question is read against: the conversation summary, which holds
+        facts such as the user's jurisdiction, and the preceding question, which gives an
+        elliptical question such as "What penalties apply?" its topic.
+
+        The preceding answer is left out, as it follows from the question before it"""
+        previous = next((m["content"] for m in reversed(self.window) if m["role"] == "user"), "")
+        context = json.dumps([self.summary, previous])
+        return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+    def _remember(self, user_input: str, response: str):
+        """Add a turn to the memory window and fold old turns into the summary periodically"""
+        self.window.append({"role": "user", "content": user_input})
+        self.window.append({"role": "assistant", "content": response})
+        self._turns_since_summary += 1
+
+        if self._turns_since_summary < self.summarize_every:
+            return
+        if len(self.window) // 2 <= self.summary_batch_turns:
+            return
+        if self._summary_task and not self._summary_task.done():
+            return
+
+        self._turns_since_summary = 0
+        oldest = list(self.window)[:2 * self.summary_batch_turns]
+        self._summary_task = asyncio.create_task(self._summarize_old(oldest))
+
+    async def _summarize_old(self, old_messages: List[Dict]):
+        """Merge the given oldest window messages into the summary, then drop them from the window"""
+        try:
+            transcript = "\n".join(f"{m['role'].title()}: {m['content']}" for m in old_messages)
+            response = await self._complete([
+                {"role": "system", "content": self.summary_prompt},
+                {"role": "user", "content": f"Existing summary:\n{self.summary or '(none)'}\n\nNew conversation turns:\n{transcript}"}
+            ], model=self.summary_deployment)
+            self.summary = response.choices[0].message.content.strip()
+            self._system_msg = self._build_system_message()
+
+            # Turns may have been evicted by the window meanwhile, so only pop what is still at the front
+            for message in old_messages:
+                if self.window and self.window[0] is message:
+                    self.window.popleft()
+        except Exception as e:
+            print(f"❌ Error summarizing conversation: {str(e)}")
+
+    async def get_responses(self, inputs: List[str]) -> List[Optional[str]]:
+        """Answer a batch of independent questions concurrently.
+
+        Each question is sent with the system prompt only, so the requests do not
+        depend on each other and the interactive chat history is left untouched."""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        system_msg = {"role": "system", "content": self.system_prompt}
+
+        async def bounded(user_input: str) -> str:
+            async with semaphore:
+                response = await self._complete([
+                    system_msg,
+                    {"role": "user", "content": user_input}
+                ])
+            return response.choices[0].message.content
+
+        results = await asyncio.gather(*(bounded(q) for q in inputs), return_exceptions=True)
+
+        responses = []
+        for user_input, result in zip(inputs, results):
+            if isinstance(result, Exception):
+                print(f"❌ Error getting response for '{user_input[:50]}': {str(result)}")
+                responses.append(None)
+            else:
+                responses.append(result)
+        return responses
+
+    async def benchmark(self, queries: List[str], min_unique_ratio: float = 0.9) -> Dict:
+        """Measure latency and throughput of concurrent completions for a set of queries.
+
+        Repeated prompts hit the service's prefix cache and overstate throughput, so
+        at least min_unique_ratio of the queries must be distinct."""
+        if not queries:
+            raise ValueError("benchmark needs at least one query")
+        unique_ratio = len(set(queries)) / len(queries)
+        if unique_ratio < min_unique_ratio:
+            raise ValueError(
+                f"Prompt diversity too low: {unique_ratio:.0%} of queries are unique, "
+                f"at least {min_unique_ratio:.0%} required"
+            )
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        system_msg = {"role": "system", "content": self.system_prompt}
+        latencies = []
+        completion_tokens = 0
+
+        async def timed(user_input: str):
+            nonlocal completion_tokens
+            async with semaphore:
+                start = time.perf_counter()
+                response = await self._complete([
+                    system_msg,
+                    {"role": "user", "content": user_input}
+                ])
+                latencies.append(time.perf_counter() - start)
+            if response.usage:
+                completion_tokens += response.usage.completion_tokens
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(timed(q) for q in queries), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "requests": len(queries),
+            "failures": sum(isinstance(result, Exception) for result in results),
+            "unique_ratio": unique_ratio,
+            "elapsed_seconds": elapsed,
+            "p50_latency_seconds": statistics.median(latencies) if latencies else None,
+            "p95_latency_seconds": latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else None,
+            "completion_tokens_per_second": completion_tokens / elapsed if elapsed else 0.0
+        }
+
+    async def submit_batch(self, questions: List[str]) -> Optional[str]:
+        """Submit questions to the Azure OpenAI Batch API for offline processing.
+
+        Batch jobs are billed at a discount and do not count against the
+        interactive rate limit, but complete asynchronously within 24 hours."""
+        try:
+            requests = [
+                json.dumps({
+                    "custom_id": f"question-{idx}",
+                    "method": "POST",
+                    "url": "/chat/completions",
+                    "body": {
+                        "model": self.deployment,
+                        "messages": [
+                            {"role": "system", "content": self.system_prompt},
+                            {"role": "user", "content": question}
+                        ]
+                    }
+                })
+                for idx, question in enumerate(questions)
+            ]
+
+            client = self._get_batch_client()
+            input_file = await client.files.create(
+                file=("questions.jsonl", "\n".join(requests).encode("utf-8")),
+                purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/chat/completions",
+                completion_window="24h"
+            )
+
+            self.batch_history.append({
+                "timestamp": datetime.now().isoformat(),
+                "batch_id": batch.id,
+                "input_file_id": input_file.id,
+                "questions": questions,
+                "status": batch.status
+            })
+            print(f"✅ Submitted batch {batch.id} with {len(questions)} questions")
+            return batch.id
+        except Exception as e:
+            print(f"❌ Error submitting batch: {str(e)}")
+            return None
+
+    async def fetch_batch(self, batch_id: str) -> Optional[Dict]:
+        """Check a submitted batch and collect its answers once it has completed.
+
+        Answers are returned in the order the questions were submitted; questions
+        that failed inside the batch are None."""
+        try:
+            client = self._get_batch_client()
+            batch = await client.batches.retrieve(batch_id)
+            result = {"batch_id": batch_id, "status": batch.status, "responses": None}
+
+            entry = next((b for b in self.batch_history if b["batch_id"] == batch_id), None)
+            if entry:
+                entry["status"] = batch.status
+
+            if batch.status == "completed" and batch.output_file_id:
+                output = await client.files.content(batch.output_file_id)
+                answers = {}
+                for line in output.text.splitlines():
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    idx = int(record["custom_id"].rsplit("-", 1)[1])
+                    choices = ((record.get("response") or {}).get("body") or {}).get("choices") or []
+                    answers[idx] = choices[0]["message"]["content"] if choices else None
+
+                count = len(entry["questions"]) if entry else max(answers, default=-1) + 1
+                result["responses"] = [answers.get(idx) for idx in range(count)]
+
+            return result
+        except Exception as e:
+            print(f"❌ Error fetching batch {batch_id}: {str(e)}")
+            return None
+
+    def _get_batch_client(self) -> AsyncAzureOpenAI:
+        """Create the Azure OpenAI client used for batch jobs on first use.
+
+        This client adds the /openai/... routes itself, so it needs the bare resource URL,
+        while the chat clients post to AZURE_OPENAI_ENDPOINT as given (a deployment or
+        /models URL). Without AZURE_OPENAI_RESOURCE_ENDPOINT, the resource URL is taken
+        from the scheme and host of AZURE_OPENAI_ENDPOINT"""
+        if self._batch_client is None:
+            resource_endpoint = os.getenv("AZURE_OPENAI_RESOURCE_ENDPOINT")
+            if not resource_endpoint:
+                endpoint = urlsplit(os.getenv("AZURE_OPENAI_ENDPOINT", ""))
+                resource_endpoint = f"{endpoint.scheme}://{endpoint.netloc}"
+            self._batch_client = AsyncAzureOpenAI(
+                azure_endpoint=resource_endpoint,
+                api_key=os.getenv("AZURE_OPENAI_KEY"),
+                api_version="2024-10-21"
+            )
+        return self._batch_client
+
+    async def _complete(self, messages: List[Dict], model: Optional[str] = None, **kwargs):
+        """Request a chat completion, retrying transient failures with exponential backoff"""
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=wait_exponential_jitter(initial=0.25, max=4),
+            retry=retry_if_exception(_is_transient_error),
+            reraise=True
+        ):
+            with attempt:
+                return await self.chat_client.complete(model=model or self.deployment, messages=messages, **kwargs)
+
+    async def aclose(self):
+        """Close the API clients and the shared HTTP session"""
+        if self._summary_task and not self._summary_task.done():
+            self._summary_task.cancel()
+        if self.chat_client:
+            await self.chat_client.close()
+            self.chat_client = None
+        if self.embeddings_client:
+            await self.embeddings_client.close()
+            self.embeddings_client = None
+        if self._batch_client:
+            await self._batch_client.close()
+            self._batch_client = None
+        if self._http:
+            await self._http.close()
+            self._http = None
+        if self._log:
+            await self._log.close()
+            self._log = None
+
+    async def _log_interaction(self, interaction: Dict):
+        """Append one interaction to the chat history log"""
+        if not self._log:
+            return
+        entry = (
+            f"Time: {interaction['timestamp']}\n"
+            f"User: {interaction['user_input']}\n"
+            f"Assistant: {interaction['assistant_response']}\n"
+            + "-" * 80 + "\n"
+        )
+        async with self._log_lock:
+            await self._log.write(entry)
+
+    async def save_chat_history(self):
+        """Flush the chat history log to disk"""
         try:
-            with open(filename, "w") as f:
-                for interaction in self.chat_history:
-                    f.write(f"Time: {interaction['timestamp']}\n")
-                    f.write(f"User: {interaction['user_input']}\n")
-                    f.write(f"Assistant: {interaction['assistant_response']}\n")
-                    f.write("-" * 80 + "\n")
-            print(f"✅ Chat history saved to {filename}")
+            if self._log:
+                async with self._log_lock:
+                    await self._log.flush()
+            print(f"✅ Chat history saved to {self.history_file}")
         except Exception as e:
             print(f"❌ Error saving chat history: {str(e)}")
 
+async def ainput(prompt: str) -> str:
+    """Read a line from stdin without blocking the event loop.
+
+    Uses a daemon thread rather than the default executor so a pending read
+    never keeps the interpreter alive after an interrupt."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def _resolve(setter, value):
+        if not future.done():
+            setter(value)
+
+    def _read():
+        try:
+            line = input(prompt)
+        except BaseException as e:
+            loop.call_soon_threadsafe(_resolve, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(_resolve, future.set_result, line)
+
+    threading.Thread(target=_read, daemon=True).start()
+    return await future
+
 async def main():
     """Main function to run the legal assistant"""
     print("\nInitializing AI Legal Assistant...")
@@ -87,34 +540,87 @@ async def main():
     
     assistant = LegalAssistant()
     if not await assistant.initialize():
+        await assistant.aclose()
         return
 
     print("\nAI Legal Assistant is ready!")
     print("Type 'exit' to end the conversation, 'save' to save chat history\n")
 
+    # Questions are answered in background tasks so the user can keep typing. Only one
+    # answer owns the console at a time and streams; answers to questions asked while it
+    # streams are printed whole once it is done, so output never interleaves
+    semaphore = asyncio.Semaphore(8)
+    console = asyncio.Lock()
+    pending = set()
+
+    def show_prompt():
+        print("\nYou: ", end="", flush=True)
+
+    def finish(response: Optional[str]):
+        if response:
+            print()
+        else:
+            print("\n❌ Failed to get response. Please try again.")
+        show_prompt()
+
+    async def handle(question: str, live: bool):
+        if live:
+            # The console was taken for this answer when the question was submitted
+            try:
+                async with semaphore:
+                    print("\nAssistant: ", end="", flush=True)
+                    response = await assistant.get_response(
+                        question, on_token=lambda token: print(token, end="", flush=True)
+                    )
+                finish(response)
+            finally:
+                console.release()
+        else:
+            async with semaphore:
+                response = await assistant.get_response(question)
+            async with console:
+                if response:
+                    print(f"\nAssistant (re: {question[:60]}): {response}", end="")
+                finish(response)
+
+    show_prompt()
     while True:
         try:
-            user_input = input("\nYou: ").strip()
+            user_input = (await ainput("")).strip()
             
             if user_input.lower() == 'exit':
+                if pending:
+                    async with console:
+                        print("\nWaiting for pending responses...")
+                    await asyncio.gather(*pending, return_exceptions=True)
                 print("\nGoodbye! Saving chat history...")
-                assistant.save_chat_history()
+                await assistant.save_chat_history()
+                await assistant.aclose()
                 break
             elif user_input.lower() == 'save':
-                assistant.save_chat_history()
+                async with console:
+                    await assistant.save_chat_history()
+                    show_prompt()
                 continue
             elif not user_input:
+                if not console.locked():
+                    show_prompt()
                 continue
 
-            response = await assistant.get_response(user_input)
-            if response:
-                print("\nAssistant:", response)
-            else:
-                print("\n❌ Failed to get response. Please try again.")
+            # Stream this answer if nothing else is printing; the owner shows the prompt when done
+            live = not console.locked()
+            if live:
+                await console.acquire()
+            task = asyncio.create_task(handle(user_input, live))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
             print("\n\nReceived interrupt signal. Saving chat history before exit...")
-            assistant.save_chat_history()
+            for task in pending:
+                task.cancel()
+            await assistant.save_chat_history()
+            await assistant.aclose()
             break
         except Exception as e:
             print(f"\n❌ An unexpected error occurred: {str(e)}")
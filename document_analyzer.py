@@ -1,36 +1,247 @@
-from typing import Dict, List, Optional
+import asyncio
+import functools
+import gzip
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, Optional, Tuple, TypedDict
 from datetime import datetime
-import json
 import logging
-from azure.ai.documentintelligence import DocumentIntelligenceClient
-from azure.ai.documentintelligence.models import AnalyzeDocumentRequest
-from azure.core.credentials import AzureKeyCredential
-from azure.core.exceptions import ResourceNotFoundError, ServiceRequestError
+import aiofiles
+import orjson
+
+if TYPE_CHECKING:
+    # aiohttp, diskcache and numpy are imported on first use: importing them up front
+    # would take most of the time it takes to import this module
+    import aiohttp
+    import diskcache
+    import numpy as np
+
+try:
+    import ahocorasick  # pyahocorasick, optional: speeds up cross-reference matching
+except ImportError:
+    ahocorasick = None
+
+# Paragraphs that open (SUMMARY) and close (SOMMAIRE) the bill summary
+_SUMMARY_START = "SUMMARY"
+_SUMMARY_END = "SOMMAIRE"
+_SUMMARY_MARKERS = frozenset((_SUMMARY_START, _SUMMARY_END))
+_MARKER_LENGTH = max(map(len, _SUMMARY_MARKERS))
+
+# Section headings: no lower-case letters and at least one capital (including accented
+# French capitals), so numbering and punctuation may come first, e.g. "1. INTERPRETATION",
+# "(1) DEFINITIONS", "SECTION 2 [REPEALED]"; page numbers have no capital and are skipped
+_HEADING_RE = re.compile(r"(?=[^a-zà-öø-ÿœß]*[A-ZÀ-ÖØ-ÞŒ])[^a-zà-öø-ÿœß]+")
+
+# Lines that introduce a theme, e.g. "Regarding Privacy Protection"
+_THEME_PREFIXES = ("Regarding", "Concerning")
+_THEME_PREFIX_RE = re.compile(r"^(?:Regarding|Concerning)\s*")
+
+# Definitions such as '"personal information" means ...' or '"renseignement" définit ...';
+# the definition runs to the end of its line
+_DEFINITION_RE = re.compile(r'"(?P<term>[^"\n]+)"[ \t]*(?P<definition>(?P<verb>means|définit)[^\n]*)')
+
+# Shapes of the records in an analysis. They stay plain dicts: they are persisted as
+# JSON, cached, and returned to callers as-is
+class KeyPoint(TypedDict):
+    text: str
+    type: str  # "summary_header" or "summary_content"
+
+class Section(TypedDict):
+    heading: str
+    content: str
+
+class Theme(TypedDict):
+    theme: str
+    supporting_points: List[str]
+    confidence: float
+
+class CrossReference(TypedDict):
+    from_section: str
+    to_section: str
+    context: str
+
+class Definition(TypedDict):
+    term: str
+    definition: str
+    language: str
+
+# Configured once per process; adding a handler per instance would repeat every log line
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+def _tokenize(content: str) -> FrozenSet[int]:
+    """Lower-cased word tokens of a section, hashed to ints so set operations compare ints."""
+    return frozenset(map(hash, content.lower().split()))
+
+def _jaccard_matrix(tokens1: List[FrozenSet[int]], tokens2: List[FrozenSet[int]]) -> "np.ndarray":
+    """Jaccard similarity of every token set in tokens1 against every one in tokens2.
+
+    Each list becomes a sparse section-by-token incidence matrix, so all the
+    intersection sizes come from a single matrix product."""
+    vocabulary: Dict[int, int] = {}
+
+    def incidence(token_sets: List[FrozenSet[int]]) -> Tuple[List[int], List[int]]:
+        indptr, indices = [0], []
+        for tokens in token_sets:
+            indices.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            indptr.append(len(indices))
+        return indptr, indices
+
+    import numpy as np
+    from scipy import sparse  # imported on first use; scipy.sparse is slow to import
+
+    rows1, rows2 = incidence(tokens1), incidence(tokens2)
+    matrices = [
+        sparse.csr_matrix((np.ones(len(indices), dtype=np.int32), indices, indptr),
+                          shape=(len(indptr) - 1, len(vocabulary)))
+        for indptr, indices in (rows1, rows2)
+    ]
+    intersection = (matrices[0] @ matrices[1].T).toarray()
+    # |A ∪ B| = |A| + |B| - |A ∩ B|; sections without tokens score 0 as in pairwise comparison
+    union = np.diff(rows1[0])[:, None] + np.diff(rows2[0])[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros(intersection.shape), where=union > 0)
+
+# Section types by heading terms, checked in order; the first type with a matching term wins
+_SECTION_TYPE_TERMS = (
+    (("summary", "sommaire"), "summary"),
+    (("définition", "definition", "interpretation"), "definitions"),
+    (("ai", "privacy"), "topic_section"),
+)
+
+@functools.lru_cache(maxsize=4096)
+def _classify_heading(heading_lower: str) -> str:
+    """Section type for a lower-cased heading; headings recur across analyses, so results are cached."""
+    for terms, section_type in _SECTION_TYPE_TERMS:
+        for term in terms:
+            if term in heading_lower:
+                return section_type
+    return "content"
+
+def _classify_paragraphs(contents: List[str]) -> List[Tuple[str, str, bool]]:
+    """Strip each paragraph and flag summary markers and likely headings.
+
+    Returns (text, upper-cased marker or "", is_heading) per paragraph."""
+    classified = []
+    for content in contents:
+        text = content.strip()
+        # O(1) length tests run first: only short paragraphs are upper-cased to look
+        # for a marker, and body paragraphs of 100+ characters skip the heading match
+        length = len(text)
+        marker = ""
+        if length <= _MARKER_LENGTH:
+            upper = text.upper()
+            if upper in _SUMMARY_MARKERS:
+                marker = upper
+        is_heading = length < 100 and _HEADING_RE.fullmatch(text) is not None
+        classified.append((text, marker, is_heading))
+    return classified
 
 class DocumentAnalyzer:
     """Handles document analysis using Azure Document Intelligence and maintains analysis history."""
     
-    def __init__(self, endpoint: str, key: str):
-        """Initialize the document analyzer with Azure credentials."""
-        # Setup logging
-        self.logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        self.logger.addHandler(handler)
+    # Analyses kept in process memory for documents that are looked at repeatedly
+    MEMORY_CACHE_SIZE = 256
+
+    def __init__(self, endpoint: str, key: str, cache_dir: Optional[str] = None,
+                 cache_ttl: Optional[float] = None):
+        """Initialize the document analyzer with Azure credentials.
+
+        Analysis results are cached on disk under cache_dir (default ~/.cache/legal-analyzer)
+        and expire after cache_ttl seconds (default: never)."""
+        self.logger = logger
         
         try:
-            self.client = DocumentIntelligenceClient(endpoint=endpoint, credential=AzureKeyCredential(key))
-            self.analysis_history = []
+            # The Azure SDK is imported and the client built on first use, see the client property
+            self._endpoint = endpoint
+            self._key = key
+            self._client = None
+            self.analysis_history = []  # also builds the URL index, see the property below
             self.current_document = None
             self.languages = []
+            self.model_id = "prebuilt-layout"
+            # JSON Lines file the history is appended to once it has been saved or loaded
+            self.history_path: Optional[str] = None
+            self._saved_count = 0
+            # Whether the log at history_path holds every analysis before _saved_count; when
+            # it does not, the next save rewrites it in full instead of appending
+            self._log_complete = False
+            # Serializes history updates from concurrent analyses
+            self._history_lock = asyncio.Lock()
+            # Created on first use so constructing an analyzer touches neither disk nor network
+            self.cache_dir = cache_dir or os.path.expanduser("~/.cache/legal-analyzer")
+            self.cache_ttl = cache_ttl
+            self._cache: Optional["diskcache.Cache"] = None
+            self._memory_cache = OrderedDict()  # cache key -> (expiry time, analysis result)
+            self._http: Optional["aiohttp.ClientSession"] = None
             self.logger.info("Document analyzer initialized successfully")
         except Exception as e:
-            self.logger.error(f"Failed to initialize document analyzer: {str(e)}")
+            self.logger.error("Failed to initialize document analyzer: %s", e)
             raise
 
+    @property
+    def client(self):
+        """The Document Intelligence client, created on first use."""
+        if self._client is None:
+            from azure.ai.documentintelligence.aio import DocumentIntelligenceClient
+            from azure.core.credentials import AzureKeyCredential
+
+            self._client = DocumentIntelligenceClient(endpoint=self._endpoint,
+                                                      credential=AzureKeyCredential(self._key))
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def analysis_history(self) -> List[Dict]:
+        """All analyses made or loaded, oldest first."""
+        return self._analysis_history
+
+    @analysis_history.setter
+    def analysis_history(self, history: List[Dict]):
+        self._analysis_history = history
+        # URL -> most recent analysis of that document, for constant-time lookups; brought
+        # up to date with the history on lookup, so analyses appended to the list directly
+        # are found too
+        self._history_index = {}
+        self._indexed_count = 0
+        # URL -> (analysis, token set of each of its sections), filled in by comparisons
+        self._token_cache = {}
+        # The log no longer matches the history: later analyses are still appended, and
+        # the next save rewrites it with the new history
+        self._saved_count = len(history)
+        self._log_complete = False
+
+    async def __aenter__(self) -> "DocumentAnalyzer":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """Close the Document Intelligence client, HTTP session and result cache."""
+        if self._client:
+            await self._client.close()
+            self._client = None
+        if self._http:
+            await self._http.close()
+            self._http = None
+        if self._cache:
+            self._cache.close()
+            self._cache = None
+
     def _handle_error(self, error: Exception, context: str) -> Dict:
         """Handle errors consistently throughout the analyzer."""
+        from azure.core.exceptions import ResourceNotFoundError, ServiceRequestError
+
         error_msg = f"Error in {context}: {str(error)}"
         self.logger.error(error_msg)
         
@@ -41,40 +252,28 @@ class DocumentAnalyzer:
         else:
             return {"error": error_msg, "error_type": "general_error"}
 
-    async def analyze_document(self, document_url: str) -> Dict:
-        """Analyze a document and extract its content and key points."""
-        self.logger.info(f"Starting analysis of document: {document_url}")
+    async def analyze_document(self, document_url: str, use_cache: bool = True) -> Dict:
+        """Analyze a document and extract its content and key points.
+
+        With use_cache, an earlier analysis of the same document version is reused."""
+        self.logger.info("Starting analysis of document: %s", document_url)
         try:
-            # Create analyze request with URL source
-            analyze_request = AnalyzeDocumentRequest(url_source=document_url)
-            
-            # Start document analysis with language detection
-            poller = self.client.begin_analyze_document(
-                model_id="prebuilt-layout",
-                body=analyze_request
-            )
-            result = poller.result()
-
-            # Detect languages in the document
-            self.languages = self._detect_languages(result)
-            self.logger.info(f"Detected languages: {self.languages}")
-
-            # Create analysis result
-            analysis_result = {
-                "timestamp": datetime.now().isoformat(),
-                "url": document_url,
-                "analysis_result": {
-                    "content": result.content,
-                    "languages": self.languages,
-                    "key_points": self._extract_key_points(result),
-                    "sections": self._extract_sections(result),
-                    "tables": self._extract_tables(result)
-                }
-            }
+            cache_key = await self._document_cache_key(document_url) if use_cache else None
+            analysis_result = self._get_cached_analysis(cache_key) if cache_key else None
+            if analysis_result is not None:
+                self.languages = analysis_result["analysis_result"].get("languages", [])
+                self.logger.info("Using cached analysis of document: %s", document_url)
+            else:
+                analysis_result = await self._run_layout_analysis(document_url)
+                if cache_key:
+                    self._cache_analysis(cache_key, analysis_result)
 
             # Update current document and history
-            self.current_document = analysis_result
-            self.analysis_history.append(analysis_result)
+            async with self._history_lock:
+                self.current_document = analysis_result
+                self.analysis_history.append(analysis_result)
+                if self.history_path:
+                    await self._append_unsaved_history()
             self.logger.info("Document analysis completed successfully")
 
             return analysis_result
@@ -82,6 +281,117 @@ class DocumentAnalyzer:
         except Exception as e:
             return self._handle_error(e, "document analysis")
 
+    async def _run_layout_analysis(self, document_url: str) -> Dict:
+        """Run the prebuilt layout model on a document and build its analysis result."""
+        from azure.ai.documentintelligence.models import AnalyzeDocumentRequest
+
+        # Create analyze request with URL source
+        analyze_request = AnalyzeDocumentRequest(url_source=document_url)
+        
+        # Start document analysis with language detection; awaiting the
+        # poller keeps the event loop free while the service processes it
+        poller = await self.client.begin_analyze_document(
+            model_id=self.model_id,
+            body=analyze_request
+        )
+        result = await poller.result()
+
+        # Detect languages in the document
+        self.languages = self._detect_languages(result)
+        self.logger.info("Detected languages: %s", self.languages)
+
+        key_points, sections = self._extract_structure(result)
+
+        # Create analysis result
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "url": document_url,
+            "analysis_result": {
+                "content": result.content,
+                "languages": self.languages,
+                "key_points": key_points,
+                "sections": sections,
+                "tables": self._extract_tables(result)
+            }
+        }
+
+    async def _document_cache_key(self, document_url: str) -> Optional[str]:
+        """Build a cache key from the document URL, its version and the analysis model.
+
+        The version is the ETag or Last-Modified header of a HEAD request, or the SHA-256
+        of the document itself when the server sends neither. Returns None when the
+        document cannot be fetched, in which case the result is not cached."""
+        import aiohttp
+
+        try:
+            if self._http is None:
+                self._http = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+            async with self._http.head(document_url, allow_redirects=True) as response:
+                version = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if not version:
+                digest = hashlib.sha256()
+                async with self._http.get(document_url, timeout=aiohttp.ClientTimeout(total=300)) as response:
+                    response.raise_for_status()
+                    async for chunk in response.content.iter_chunked(1 << 16):
+                        digest.update(chunk)
+                version = digest.hexdigest()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.warning("Could not check document version, skipping cache: %s", e)
+            return None
+        return hashlib.sha256(f"{document_url}\n{version}\n{self.model_id}".encode("utf-8")).hexdigest()
+
+    def _get_cache(self) -> "diskcache.Cache":
+        """Open the on-disk analysis cache on first use."""
+        if self._cache is None:
+            import diskcache
+
+            self._cache = diskcache.Cache(self.cache_dir)
+        return self._cache
+
+    def _get_cached_analysis(self, cache_key: str) -> Optional[Dict]:
+        """Return the cached analysis result for a key, checking process memory before disk."""
+        entry = self._memory_cache.get(cache_key)
+        if entry is not None:
+            expires_at, analysis_result = entry
+            if expires_at > time.monotonic():
+                self._memory_cache.move_to_end(cache_key)
+                return analysis_result
+            del self._memory_cache[cache_key]
+
+        payload = self._get_cache().get(cache_key)
+        if payload is None:
+            return None
+        analysis_result = orjson.loads(gzip.decompress(payload))
+        self._remember_analysis(cache_key, analysis_result)
+        return analysis_result
+
+    def _cache_analysis(self, cache_key: str, analysis_result: Dict):
+        """Store an analysis result in memory and on disk, gzip-compressed."""
+        self._get_cache().set(cache_key, gzip.compress(orjson.dumps(analysis_result)), expire=self.cache_ttl)
+        self._remember_analysis(cache_key, analysis_result)
+
+    def _remember_analysis(self, cache_key: str, analysis_result: Dict):
+        """Keep an analysis in the bounded in-process cache, evicting the least recently used."""
+        expires_at = time.monotonic() + self.cache_ttl if self.cache_ttl is not None else float("inf")
+        self._memory_cache[cache_key] = (expires_at, analysis_result)
+        self._memory_cache.move_to_end(cache_key)
+        if len(self._memory_cache) > self.MEMORY_CACHE_SIZE:
+            self._memory_cache.popitem(last=False)
+
+    async def analyze_documents(self, document_urls: List[str], concurrency: int = 8) -> List[Dict]:
+        """Analyze several documents concurrently, returning results in input order."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def analyze_one(document_url: str) -> Dict:
+            async with semaphore:
+                return await self.analyze_document(document_url)
+
+        results = await asyncio.gather(*(analyze_one(url) for url in document_urls), return_exceptions=True)
+        return [
+            self._handle_error(result, "document analysis") if isinstance(result, Exception) else result
+            for result in results
+        ]
+
     def _detect_languages(self, result) -> List[Dict[str, str]]:
         """Detect languages present in the document."""
         detected_languages = []
@@ -93,58 +403,49 @@ class DocumentAnalyzer:
                 })
         return detected_languages
 
-    def _extract_key_points(self, result) -> List[Dict]:
-        """Extract key points from the document analysis result.
-        Currently focuses on summary and key sections."""
-        key_points = []
+    def _extract_structure(self, result) -> Tuple[List[KeyPoint], List[Section]]:
+        """Extract key points and main sections in a single pass over the paragraphs.
+        Key points currently focus on the summary; sections start at upper-case headings."""
+        key_points: List[KeyPoint] = []
+        sections: List[Section] = []
         if hasattr(result, 'paragraphs'):
             in_summary = False
-            summary_content = []
-            
-            for paragraph in result.paragraphs:
-                text = paragraph.content.strip()
-                
-                # Check if this is a summary section
-                if text.upper() == "SUMMARY":
-                    in_summary = True
+            summary_content: List[str] = []
+            current_section = None
+            section_content = []
+            # Bound appends skip the attribute lookup for every paragraph
+            add_summary = summary_content.append
+            add_line = section_content.append
+
+            def flush_summary():
+                # Add collected summary as a key point, reusing the buffer for the next block
+                if summary_content:
                     key_points.append({
-                        "text": text,
-                        "type": "summary_header"
+                        "text": " ".join(summary_content),
+                        "type": "summary_content"
                     })
-                # If we're in a summary section, collect the content
-                elif in_summary and text and not text.upper() == "SOMMAIRE":
-                    summary_content.append(text)
-                # Exit summary section when we hit SOMMAIRE
-                elif text.upper() == "SOMMAIRE":
-                    in_summary = False
-                    # Add collected summary as a key point
-                    if summary_content:
+                    summary_content.clear()
+            
+            contents = [paragraph.content for paragraph in result.paragraphs]
+            for text, marker, is_heading in _classify_paragraphs(contents):
+                if marker:
+                    # Check if this is a summary section
+                    if marker == _SUMMARY_START:
+                        in_summary = True
                         key_points.append({
-                            "text": " ".join(summary_content),
-                            "type": "summary_content"
+                            "text": text,
+                            "type": "summary_header"
                         })
-                    summary_content = []
-            
-            # Add any remaining summary content
-            if summary_content:
-                key_points.append({
-                    "text": " ".join(summary_content),
-                    "type": "summary_content"
-                })
+                    # Exit summary section when we hit SOMMAIRE
+                    else:
+                        in_summary = False
+                        flush_summary()
+                # If we're in a summary section, collect the content
+                elif in_summary and text:
+                    add_summary(text)
                 
-        return key_points
-
-    def _extract_sections(self, result) -> List[Dict]:
-        """Extract main document sections."""
-        sections = []
-        if hasattr(result, 'paragraphs'):
-            current_section = None
-            section_content = []
-            
-            for paragraph in result.paragraphs:
-                text = paragraph.content.strip()
                 # Check if this is a section header (simple heuristic)
-                if text.isupper() and len(text) < 100:  # Likely a header
+                if is_heading:  # Likely a header
                     if current_section:
                         sections.append({
                             "heading": current_section,
@@ -152,8 +453,12 @@ class DocumentAnalyzer:
                         })
                     current_section = text
                     section_content = []
+                    add_line = section_content.append
                 elif current_section:
-                    section_content.append(text)
+                    add_line(text)
+            
+            # Add any remaining summary content
+            flush_summary()
             
             # Add the last section
             if current_section:
@@ -162,76 +467,207 @@ class DocumentAnalyzer:
                     "content": "\n".join(section_content)
                 })
         
-        return sections
+        return key_points, sections
+
+    def _extract_key_points(self, result) -> List[KeyPoint]:
+        """Extract key points only; analyze_document uses _extract_structure to get both at once."""
+        return self._extract_structure(result)[0]
+
+    def _extract_sections(self, result) -> List[Section]:
+        """Extract sections only; analyze_document uses _extract_structure to get both at once."""
+        return self._extract_structure(result)[1]
 
     def _extract_tables(self, result) -> List[Dict]:
-        """Extract tables with basic structure verification."""
+        """Extract tables, placing each cell by its row and column index."""
         tables = []
         if hasattr(result, 'tables'):
             for idx, table in enumerate(result.tables):
                 try:
-                    table_data = []
-                    if table.row_count and table.column_count:  # Verify table has structure
-                        for row in range(table.row_count):
-                            row_data = []
-                            for col in range(table.column_count):
-                                cell_idx = row * table.column_count + col
-                                if cell_idx < len(table.cells):  # Boundary check
-                                    cell = table.cells[cell_idx]
-                                    row_data.append(cell.content if cell.content else "")
-                                else:
-                                    row_data.append("")  # Empty cell for missing data
-                            table_data.append(row_data)
+                    row_count, column_count = table.row_count, table.column_count
+                    if row_count and column_count:  # Verify table has structure
+                        # Single pass over the cells; missing cells stay empty and
+                        # merged cells fill every position they span
+                        table_data = [[""] * column_count for _ in range(row_count)]
+                        for cell in table.cells:
+                            row, col = cell.row_index, cell.column_index
+                            row_end = min(row + (cell.row_span or 1), row_count)
+                            col_end = min(col + (cell.column_span or 1), column_count)
+                            span = [cell.content or ""] * (col_end - col)
+                            for row_data in table_data[row:row_end]:
+                                row_data[col:col_end] = span
                         
                         tables.append({
                             "id": f"table_{idx + 1}",
                             "rows": table_data,
-                            "row_count": table.row_count,
-                            "column_count": table.column_count
+                            "row_count": row_count,
+                            "column_count": column_count
                         })
                 except Exception as e:
                     # Log error but continue processing other tables
-                    print(f"Error processing table {idx}: {str(e)}")
+                    self.logger.warning("Error processing table %s: %s", idx, e)
                     continue
         
         return tables
 
-    def save_analysis_history(self, filepath: str) -> Dict:
-        """Save the analysis history to a JSON file."""
+    @staticmethod
+    def _sidecar_path(filepath: str) -> str:
+        """Path of the small file that holds the current document next to a history log."""
+        if filepath.endswith(".gz"):
+            filepath = filepath[:-3]
+        return os.path.splitext(filepath)[0] + ".current.json"
+
+    @staticmethod
+    def _to_json_lines(records: List[Dict], filepath: str) -> bytes:
+        """Serialize records as compact JSON Lines, gzip-compressed for a .gz history log.
+
+        Each write to a .gz log is its own gzip member; concatenated members read back
+        as one stream, so appending never recompresses earlier records."""
+        payload = b"".join(orjson.dumps(record) + b"\n" for record in records)
+        if filepath.endswith(".gz"):
+            return gzip.compress(payload, compresslevel=6)
+        return payload
+
+    def _unsaved(self) -> Tuple[List[Dict], int]:
+        """Return the analyses not yet written to the history log and the count to record once they are.
+
+        _saved_count only moves after a successful write, so a failed write is retried."""
+        end = len(self.analysis_history)
+        return self.analysis_history[self._saved_count:end], end
+
+    def set_history_path(self, filepath: Optional[str]):
+        """Append each completed analysis to the JSON Lines log at filepath, or stop when None.
+
+        Only analyses made from now on are appended. The analyses already in memory are
+        written by the next save_analysis_history, which rewrites the log in full."""
+        self.history_path = filepath
+        self._saved_count = len(self.analysis_history)
+        self._log_complete = False
+
+    async def _append_unsaved_history(self):
+        """Append new analyses to the history log without rewriting earlier records."""
         try:
-            with open(filepath, 'w') as f:
-                json.dump({
-                    "current_document": self.current_document,
-                    "analysis_history": self.analysis_history
-                }, f, indent=2)
-            self.logger.info(f"Analysis history saved to {filepath}")
+            pending, saved_count = self._unsaved()
+            async with aiofiles.open(self.history_path, 'ab') as f:
+                await f.write(self._to_json_lines(pending, self.history_path))
+            self._saved_count = saved_count
+            async with aiofiles.open(self._sidecar_path(self.history_path), 'wb') as f:
+                await f.write(orjson.dumps(self.current_document))
+        except Exception as e:
+            self._handle_error(e, "appending analysis history")
+
+    async def save_analysis_history(self, filepath: str) -> Dict:
+        """Save the analysis history as JSON Lines, with the current document in a sidecar file.
+
+        A path ending in .gz writes a gzip-compressed log.
+
+        Saving to the file the history was last saved to or loaded from only appends
+        the analyses added since; later analyses are then appended automatically."""
+        try:
+            async with self._history_lock:
+                await self._write_history(filepath)
+            self.logger.info("Analysis history saved to %s", filepath)
             return {"success": True, "message": "Analysis history saved successfully"}
         except Exception as e:
             return self._handle_error(e, "saving analysis history")
 
-    def load_analysis_history(self, filepath: str) -> Dict:
-        """Load analysis history from a JSON file."""
+    async def _write_history(self, filepath: str):
+        """Write the history log and sidecar without blocking the event loop; caller holds the history lock."""
+        records, saved_count = self._unsaved()
+        if filepath == self.history_path and self._log_complete:
+            mode = 'ab'
+        else:
+            mode, records = 'wb', self.analysis_history[:saved_count]
+            # A rewrite that fails part-way leaves a truncated log, so it must be redone
+            self._log_complete = False
+        async with aiofiles.open(filepath, mode) as f:
+            await f.write(self._to_json_lines(records, filepath))
+        self.history_path = filepath
+        self._saved_count = saved_count
+        self._log_complete = True
+        async with aiofiles.open(self._sidecar_path(filepath), 'wb') as f:
+            await f.write(orjson.dumps(self.current_document))
+
+    async def load_analysis_history(self, filepath: str) -> Dict:
+        """Load analysis history from a JSON Lines file, gzip-compressed if the path ends in .gz.
+
+        Files in the older single-document JSON format are loaded and rewritten as JSON Lines."""
         try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                self.current_document = data.get("current_document")
-                self.analysis_history = data.get("analysis_history", [])
-            self.logger.info(f"Analysis history loaded from {filepath}")
+            async with aiofiles.open(filepath, 'rb') as f:
+                payload = await f.read()
+            if filepath.endswith(".gz"):
+                payload = gzip.decompress(payload)
+            lines = [line for line in payload.splitlines(keepends=True) if line.strip()]
+
+            async with self._history_lock:
+                data = self._parse_legacy_history(lines)
+                if data is not None:
+                    self.current_document = data.get("current_document")
+                    self.analysis_history = data.get("analysis_history", [])
+                    self.history_path = None
+                    await self._write_history(filepath)
+                    self.logger.info("Migrated analysis history in %s to JSON Lines", filepath)
+                else:
+                    self.analysis_history = [orjson.loads(line) for line in lines]
+                    sidecar = self._sidecar_path(filepath)
+                    if os.path.exists(sidecar):
+                        async with aiofiles.open(sidecar, 'rb') as f:
+                            self.current_document = orjson.loads(await f.read())
+                    else:
+                        self.current_document = self.analysis_history[-1] if self.analysis_history else None
+                    self.history_path = filepath
+                    self._saved_count = len(self.analysis_history)
+                    self._log_complete = True
+            self.logger.info("Analysis history loaded from %s", filepath)
             return {"success": True, "message": "Analysis history loaded successfully"}
         except FileNotFoundError:
             return {"error": f"No analysis history found at {filepath}", "error_type": "not_found"}
-        except json.JSONDecodeError:
+        except (orjson.JSONDecodeError, gzip.BadGzipFile):
             return {"error": f"Invalid JSON format in {filepath}", "error_type": "format_error"}
         except Exception as e:
             return self._handle_error(e, "loading analysis history")
 
+    @staticmethod
+    def _parse_legacy_history(lines: List[bytes]) -> Optional[Dict]:
+        """Parse a history file written in the older single-document JSON format, if it is one."""
+        if not lines:
+            return None
+        try:
+            first = orjson.loads(lines[0])
+        except orjson.JSONDecodeError:
+            # An indented document does not parse line by line
+            return orjson.loads(b"".join(lines))
+        if isinstance(first, dict) and "analysis_history" in first:
+            return first
+        return None
+
+    def _find_analysis(self, document_url: str) -> Optional[Dict]:
+        """The most recent analysis of a document, or the current document if it is that one.
+
+        The current document can come from a sidecar file or be set directly without
+        being in the history."""
+        self._update_history_index()
+        doc = self._history_index.get(document_url)
+        if doc is None and self.current_document and self.current_document.get("url") == document_url:
+            doc = self.current_document
+        return doc
+
+    def _update_history_index(self):
+        """Index the analyses added to the history since the last lookup.
+
+        The index is rebuilt when analyses have been removed from the history."""
+        history = self._analysis_history
+        if len(history) < self._indexed_count:
+            self._history_index, self._indexed_count = {}, 0
+        for doc in history[self._indexed_count:]:
+            self._history_index[doc["url"]] = doc
+        self._indexed_count = len(history)
+
     def compare_documents(self, doc1_url: str, doc2_url: str) -> Dict:
         """Compare two documents and identify similarities and differences."""
         try:
             # Get analysis results for both documents
-            doc1_analysis = self.current_document if self.current_document and self.current_document['url'] == doc1_url else \
-                          next((doc for doc in self.analysis_history if doc['url'] == doc1_url), None)
-            doc2_analysis = next((doc for doc in self.analysis_history if doc['url'] == doc2_url), None)
+            doc1_analysis = self._find_analysis(doc1_url)
+            doc2_analysis = self._find_analysis(doc2_url)
 
             # If either document hasn't been analyzed yet, return error
             if not doc1_analysis or not doc2_analysis:
@@ -253,8 +689,10 @@ class DocumentAnalyzer:
             }
 
             # Compare sections
-            sections1 = {s['heading']: s['content'] for s in doc1_analysis['analysis_result']['sections']}
-            sections2 = {s['heading']: s['content'] for s in doc2_analysis['analysis_result']['sections']}
+            sections1 = dict(zip((s['heading'] for s in doc1_analysis['analysis_result']['sections']),
+                                 self._section_tokens(doc1_analysis)))
+            sections2 = dict(zip((s['heading'] for s in doc2_analysis['analysis_result']['sections']),
+                                 self._section_tokens(doc2_analysis)))
 
             # Find common and unique sections
             common_headers = set(sections1.keys()) & set(sections2.keys())
@@ -264,7 +702,9 @@ class DocumentAnalyzer:
             for header in common_headers:
                 comparison_result['common_sections'].append({
                     'heading': header,
-                    'similarity_score': self._calculate_text_similarity(sections1[header], sections2[header])
+                    'similarity_score': self._calculate_text_similarity(
+                        sections1[header], sections2[header]
+                    )
                 })
 
             comparison_result['unique_sections']['document1'] = list(unique_to_doc1)
@@ -275,35 +715,70 @@ class DocumentAnalyzer:
         except Exception as e:
             return self._handle_error(e, "document comparison")
 
+    def section_similarity_matrix(self, doc1_url: str, doc2_url: str) -> Dict:
+        """Score every section of one analyzed document against every section of another.
+
+        Row i of the scores holds the Jaccard similarity of the first document's i-th
+        section to each section of the second, in heading order."""
+        try:
+            doc1_analysis = self._find_analysis(doc1_url)
+            doc2_analysis = self._find_analysis(doc2_url)
+
+            if not doc1_analysis or not doc2_analysis:
+                return {"error": "One or both documents have not been analyzed yet"}
+
+            sections1 = doc1_analysis['analysis_result']['sections']
+            sections2 = doc2_analysis['analysis_result']['sections']
+            scores = _jaccard_matrix(self._section_tokens(doc1_analysis), self._section_tokens(doc2_analysis))
+
+            return {
+                "document1": doc1_url,
+                "document2": doc2_url,
+                "headings1": [s['heading'] for s in sections1],
+                "headings2": [s['heading'] for s in sections2],
+                "scores": scores.tolist()
+            }
+
+        except Exception as e:
+            return self._handle_error(e, "section similarity")
+
+    def _section_tokens(self, analysis: Dict) -> List[FrozenSet[int]]:
+        """Token sets of an analysis's sections, in section order, computed once per analysis.
+
+        Cached by URL and dropped when that URL is analyzed again or the history is replaced."""
+        cached = self._token_cache.get(analysis["url"])
+        if cached is None or cached[0] is not analysis:
+            tokens = [_tokenize(s['content']) for s in analysis['analysis_result']['sections']]
+            cached = self._token_cache[analysis["url"]] = (analysis, tokens)
+        return cached[1]
+
     def _compare_languages(self, langs1: List[Dict], langs2: List[Dict]) -> Dict:
         """Compare detected languages between two documents."""
+        codes1 = [l['language'] for l in langs1]
+        codes2 = [l['language'] for l in langs2]
+        # Set membership keeps this linear while the lists keep detection order
+        set1, set2 = set(codes1), set(codes2)
         return {
-            "common_languages": [l1['language'] for l1 in langs1 if any(l2['language'] == l1['language'] for l2 in langs2)],
-            "unique_to_first": [l1['language'] for l1 in langs1 if not any(l2['language'] == l1['language'] for l2 in langs2)],
-            "unique_to_second": [l2['language'] for l2 in langs2 if not any(l1['language'] == l2['language'] for l1 in langs1)]
+            "common_languages": [code for code in codes1 if code in set2],
+            "unique_to_first": [code for code in codes1 if code not in set2],
+            "unique_to_second": [code for code in codes2 if code not in set1]
         }
 
-    def _calculate_text_similarity(self, text1: str, text2: str) -> float:
-        """Calculate similarity score between two text sections using simple token overlap."""
-        tokens1 = set(text1.lower().split())
-        tokens2 = set(text2.lower().split())
-        
+    def _calculate_text_similarity(self, tokens1: FrozenSet[int], tokens2: FrozenSet[int]) -> float:
+        """Calculate similarity score between two tokenized sections using simple token overlap."""
         if not tokens1 or not tokens2:
             return 0.0
             
-        intersection = tokens1 & tokens2
-        union = tokens1 | tokens2
+        # |A ∪ B| = |A| + |B| - |A ∩ B|, so the union set is never built
+        intersection = len(tokens1 & tokens2)
         
-        return len(intersection) / len(union)  # Jaccard similarity
+        return intersection / (len(tokens1) + len(tokens2) - intersection)  # Jaccard similarity
 
     def analyze_document_content(self, document_url: str = None) -> Dict:
         """Perform deeper semantic analysis of the current document or a specific one."""
         try:
             # Use current document if no URL provided
-            doc = self.current_document if document_url is None else next(
-                (doc for doc in self.analysis_history if doc["url"] == document_url),
-                None
-            )
+            doc = self.current_document if document_url is None else self._find_analysis(document_url)
             
             if not doc:
                 return self._handle_error(ValueError("Document not found"), "analyze_document_content")
@@ -321,9 +796,9 @@ class DocumentAnalyzer:
         except Exception as e:
             return self._handle_error(e, "analyze_document_content")
 
-    def _extract_themes(self, content: str) -> List[Dict]:
+    def _extract_themes(self, content: str) -> List[Theme]:
         """Extract key themes from document content."""
-        themes = []
+        themes: List[Theme] = []
         if not content:
             return themes
             
@@ -332,38 +807,25 @@ class DocumentAnalyzer:
         
         for para in paragraphs:
             lines = [l.strip() for l in para.split('\n') if l.strip()]
-            if not lines:
-                continue
-                
-            # Process each line that starts with a theme indicator
+            
+            # Single pass: each theme line opens a theme, and the lines after it
+            # are its supporting points until the next theme or the end of the paragraph
+            add_point = None  # bound append of the open theme's supporting points
             for line in lines:
-                if line.startswith(("Regarding", "Concerning")):
-                    # Extract theme by removing the prefix
-                    theme = line
-                    for prefix in ("Regarding", "Concerning"):
-                        if theme.startswith(prefix):
-                            theme = theme[len(prefix):].strip()
-                            break
-                    
-                    # Get supporting points from subsequent lines
-                    line_idx = lines.index(line)
+                if line.startswith(_THEME_PREFIXES):
                     supporting_points = []
-                    
-                    # Collect supporting points until we hit another theme or end of paragraph
-                    for next_line in lines[line_idx + 1:]:
-                        if next_line.startswith(("Regarding", "Concerning")):
-                            break
-                        supporting_points.append(next_line)
-                    
+                    add_point = supporting_points.append
                     themes.append({
-                        "theme": theme,
+                        "theme": _THEME_PREFIX_RE.sub("", line, count=1),
                         "supporting_points": supporting_points,
                         "confidence": 0.8
                     })
+                elif add_point is not None:
+                    add_point(line)
                 
         return themes
 
-    def _analyze_semantic_structure(self, sections: List[Dict]) -> Dict:
+    def _analyze_semantic_structure(self, sections: List[Section]) -> Dict:
         """Analyze the semantic structure of document sections."""
         if not sections:
             return {
@@ -407,24 +869,29 @@ class DocumentAnalyzer:
 
     def _determine_section_type(self, heading: str, content: str) -> str:
         """Determine the type of a section based on its heading and content."""
-        heading_lower = heading.lower() if heading else ""
-        
-        if any(term in heading_lower for term in ["summary", "sommaire"]):
-            return "summary"
-        elif any(term in heading_lower for term in ["définition", "definition", "interpretation"]):
-            return "definitions"
-        elif "ai" in heading_lower or "privacy" in heading_lower:
-            return "topic_section"
-        else:
-            return "content"
+        return _classify_heading(heading.lower() if heading else "")
 
-    def _find_cross_references(self, sections: List[Dict]) -> List[Dict]:
+    def _find_cross_references(self, sections: List[Section]) -> List[CrossReference]:
         """Identify cross-references between document sections."""
-        references = []
+        references: List[CrossReference] = []
         if not sections:
             return references
             
-        section_headings = {s.get("heading", "") for s in sections if s.get("heading")}
+        section_headings = frozenset(s["heading"] for s in sections if s.get("heading"))
+        
+        if ahocorasick is not None and section_headings:
+            # One automaton over all headings finds every heading in a section's
+            # content in a single pass instead of one substring scan per heading
+            automaton = ahocorasick.Automaton()
+            for other_heading in section_headings:
+                automaton.add_word(other_heading, other_heading)
+            automaton.make_automaton()
+            
+            def find_headings(content: str) -> List[str]:
+                return list(dict.fromkeys(match for _, match in automaton.iter(content)))
+        else:
+            def find_headings(content: str) -> List[str]:
+                return [h for h in section_headings if h in content]
         
         for section in sections:
             heading = section.get("heading")
@@ -433,8 +900,8 @@ class DocumentAnalyzer:
             if not heading or not content:
                 continue
                 
-            for other_heading in section_headings:
-                if other_heading and other_heading in content and other_heading != heading:
+            for other_heading in find_headings(content):
+                if other_heading != heading:
                     references.append({
                         "from_section": heading,
                         "to_section": other_heading,
@@ -443,24 +910,13 @@ class DocumentAnalyzer:
         
         return references
 
-    def _extract_definitions(self, content: str) -> List[Dict]:
+    def _extract_definitions(self, content: str) -> List[Definition]:
         """Extract defined terms and their definitions from the document."""
-        definitions = []
-        lines = content.split('\n')
-        
-        for i, line in enumerate(lines):
-            # Look for common definition patterns
-            if '"' in line and ('means' in line.lower() or 'définit' in line.lower()):
-                try:
-                    term = line[line.index('"'):line.rindex('"')+1]
-                    definition = line[line.rindex('"')+1:].trip()
-                    if definition.startswith('means') or definition.startswith('définit'):
-                        definitions.append({
-                            "term": term.strip('"'),
-                            "definition": definition.strip(),
-                            "language": "en" if "means" in definition.lower() else "fr"
-                        })
-                except ValueError:
-                    continue
-        
-        return definitions
\ No newline at end of file
+        return [
+            {
+                "term": match.group("term"),
+                "definition": match.group("definition").strip(),
+                "language": "en" if match.group("verb") == "means" else "fr"
+            }
+            for match in _DEFINITION_RE.finditer(content)
+        ]
@@ -1,10 +1,13 @@
 import os
 import asyncio
 from dotenv import load_dotenv
-from document_analyzer import DocumentAnalyzer
+from document_analyzer import DocumentAnalyzer, _tokenize
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
+from types import SimpleNamespace
+import gzip
 import json
+import tempfile
 from datetime import datetime
 
 # Load environment variables
@@ -21,7 +24,8 @@ async def main():
     document_url = "https://www.parl.ca/Content/Bills/441/Government/C-27/C-27_1/C-27_1.PDF"
     
     print("Analyzing document...")
-    result = await analyzer.analyze_document(document_url)
+    async with analyzer:
+        result = await analyzer.analyze_document(document_url)
     
     if "error" in result:
         print(f"Error: {result['error']}")
@@ -39,23 +43,41 @@ async def main():
                 print(f"- {point['text'][:200]}...")
         
         # Save the analysis results
-        analyzer.save_analysis_history("legal_document_analysis.json")
-        print("\nAnalysis results saved to legal_document_analysis.json")
+        await analyzer.save_analysis_history("legal_document_analysis.jsonl")
+        print("\nAnalysis results saved to legal_document_analysis.jsonl")
 
 if __name__ == "__main__":
     asyncio.run(main())
 
+
+def analysis(url, sections, languages=()):
+    """An analysis record with the given (heading, content) sections and language codes."""
+    return {"url": url, "analysis_result": {
+        "sections": [{"heading": heading, "content": content} for heading, content in sections],
+        "languages": [{"language": language, "confidence": 1.0} for language in languages]
+    }}
+
+
+def temp_path(test_case, filename):
+    """A path in a temporary directory that is removed when the test finishes."""
+    tmp = tempfile.TemporaryDirectory()
+    test_case.addCleanup(tmp.cleanup)
+    return os.path.join(tmp.name, filename)
+
+
+def logged_urls(path):
+    """The URLs of the analyses in a JSON Lines history log, gzipped or not."""
+    with (gzip.open(path, "rt") if path.endswith(".gz") else open(path)) as f:
+        return [json.loads(line)["url"] for line in f]
+
 class TestDocumentAnalyzer(unittest.TestCase):
-    @patch('document_analyzer.DocumentIntelligenceClient')
-    def setUp(self, mock_client):
+    def setUp(self):
         """Set up test cases."""
         self.endpoint = "mock_endpoint"
         self.key = "mock_key"
+        # The Azure client is only created on first use, so nothing needs mocking here
         self.analyzer = DocumentAnalyzer(self.endpoint, self.key)
         
-        # Mock the Azure client
-        mock_client.return_value.begin_analyze_document.return_value = Mock()
-        
         self.test_document = {
             "url": "test_url",
             "timestamp": "2025-05-06T14:25:24.390855",
@@ -91,6 +113,34 @@ class TestDocumentAnalyzer(unittest.TestCase):
         self.assertTrue(any(t["theme"].strip() == "Privacy Protection" for t in themes))
         self.assertTrue(any(t["theme"].strip() == "AI Systems" for t in themes))
         
+    def test_instances_share_one_log_handler(self):
+        """Test that creating analyzers does not add a log handler per instance"""
+        handlers = list(self.analyzer.logger.handlers)
+        other = DocumentAnalyzer(self.endpoint, self.key)
+
+        self.assertIs(other.logger, self.analyzer.logger)
+        self.assertEqual(other.logger.handlers, handlers)
+
+    def test_client_is_created_on_first_use(self):
+        """Test that the Azure client is only built when it is first needed"""
+        self.assertIsNone(self.analyzer._client)
+
+        with patch('azure.ai.documentintelligence.aio.DocumentIntelligenceClient') as client_class:
+            client = self.analyzer.client
+            self.assertIs(self.analyzer.client, client)
+
+        client_class.assert_called_once()
+        self.assertEqual(client_class.call_args.kwargs["endpoint"], self.endpoint)
+
+    def test_theme_extraction_with_repeated_theme_lines(self):
+        """Test that a repeated theme line collects its own supporting points"""
+        themes = self.analyzer._extract_themes("Regarding Fees\nFiling fee\nRegarding Fees\nAnnual fee")
+
+        self.assertEqual(
+            [(t["theme"], t["supporting_points"]) for t in themes],
+            [("Fees", ["Filing fee"]), ("Fees", ["Annual fee"])]
+        )
+
     def test_cross_references(self):
         """Test that cross-references between sections are identified"""
         result = self.analyzer.analyze_document_content()
@@ -102,6 +152,44 @@ class TestDocumentAnalyzer(unittest.TestCase):
             for ref in refs
         ))
         
+    def test_cross_references_match_without_ahocorasick(self):
+        """Test that the substring fallback finds the same references as the automaton"""
+        sections = self.analyzer.current_document["analysis_result"]["sections"]
+        key = lambda ref: (ref["from_section"], ref["to_section"])
+        expected = sorted(self.analyzer._find_cross_references(sections), key=key)
+        
+        with patch('document_analyzer.ahocorasick', None):
+            refs = sorted(self.analyzer._find_cross_references(sections), key=key)
+        
+        self.assertEqual(refs, expected)
+        
+    def test_section_types(self):
+        """Test that headings are classified by their first matching term"""
+        classify = self.analyzer._determine_section_type
+        self.assertEqual(classify("SUMMARY", ""), "summary")
+        self.assertEqual(classify("Définitions et interprétation", ""), "definitions")
+        self.assertEqual(classify("Privacy Section", ""), "topic_section")
+        self.assertEqual(classify("Coming into Force", ""), "content")
+        self.assertEqual(classify(None, ""), "content")
+
+    def test_definition_extraction(self):
+        """Test that quoted terms followed by means/définit are extracted"""
+        content = (
+            'In this Act,\n'
+            '"personal information" means information about an identifiable individual.\n'
+            '"organisation" définit une association ou une société.\n'
+            'A "quoted" word that is not a definition.'
+        )
+
+        self.assertEqual(self.analyzer._extract_definitions(content), [
+            {"term": "personal information",
+             "definition": "means information about an identifiable individual.",
+             "language": "en"},
+            {"term": "organisation",
+             "definition": "définit une association ou une société.",
+             "language": "fr"}
+        ])
+
     def test_semantic_analysis(self):
         """Test complete semantic analysis functionality"""
         result = self.analyzer.analyze_document_content()
@@ -117,5 +205,261 @@ class TestDocumentAnalyzer(unittest.TestCase):
         self.assertIn("section_relationships", structure)
         self.assertIn("section_types", structure)
 
+    def test_compare_documents(self):
+        """Test that common sections are scored and unique sections are listed"""
+        self.analyzer.analysis_history = [
+            analysis("doc1", [("PRIVACY", "Data must be protected"), ("PENALTIES", "Fines apply")], ["en", "fr"]),
+            analysis("doc2", [("PRIVACY", "data must be encrypted"), ("SCOPE", "Applies to all")], ["en", "de"])
+        ]
+
+        result = self.analyzer.compare_documents("doc1", "doc2")
+
+        self.assertEqual(result["common_sections"], [{"heading": "PRIVACY", "similarity_score": 0.6}])
+        self.assertEqual(result["unique_sections"], {"document1": ["PENALTIES"], "document2": ["SCOPE"]})
+        self.assertEqual(result["language_comparison"], {
+            "common_languages": ["en"],
+            "unique_to_first": ["fr"],
+            "unique_to_second": ["de"]
+        })
+
+    def test_documents_are_looked_up_by_url(self):
+        """Test that analyzed, assigned and appended documents are found by URL"""
+        self.analyzer.analysis_history = [self.test_document]
+        self.analyzer._run_layout_analysis = AsyncMock(return_value=dict(self.test_document, url="second_url"))
+        asyncio.run(self.analyzer.analyze_document("second_url", use_cache=False))
+        self.analyzer.analysis_history.append(dict(self.test_document, url="third_url"))
+
+        self.assertIn("key_themes", self.analyzer.analyze_document_content("test_url"))
+        self.assertIn("key_themes", self.analyzer.analyze_document_content("second_url"))
+        self.assertEqual(self.analyzer.analyze_document_content("missing_url")["error_type"], "general_error")
+        self.assertNotIn("error", self.analyzer.compare_documents("test_url", "second_url"))
+        self.assertNotIn("error", self.analyzer.compare_documents("second_url", "third_url"))
+
+    def test_section_tokens_are_cached_per_analysis(self):
+        """Test that section tokens are computed once per analysis and again after re-analysis"""
+        self.analyzer.analysis_history = [analysis("doc1", [("PRIVACY", "Data must be protected")]),
+                                          analysis("doc2", [("PRIVACY", "Data must be encrypted")])]
+
+        with patch('document_analyzer._tokenize', wraps=_tokenize) as tokenize:
+            self.analyzer.compare_documents("doc1", "doc2")
+            self.analyzer.compare_documents("doc1", "doc2")
+            self.assertEqual(tokenize.call_count, 2)
+
+            self.analyzer._run_layout_analysis = AsyncMock(return_value=analysis("doc1", [("PRIVACY", "Data must be protected")]))
+            asyncio.run(self.analyzer.analyze_document("doc1", use_cache=False))
+            self.analyzer.compare_documents("doc1", "doc2")
+            self.assertEqual(tokenize.call_count, 3)
+
+    def test_section_similarity_matrix(self):
+        """Test that the similarity matrix matches pairwise section comparison"""
+        contents1 = ["Data must be protected", "Fines apply", ""]
+        contents2 = ["data must be encrypted", "Applies to all data"]
+        self.analyzer.analysis_history = [
+            analysis("doc1", [(f"PART {i}", content) for i, content in enumerate(contents1)]),
+            analysis("doc2", [(f"PART {i}", content) for i, content in enumerate(contents2)])
+        ]
+
+        result = self.analyzer.section_similarity_matrix("doc1", "doc2")
+
+        similarity = self.analyzer._calculate_text_similarity
+        expected = [[similarity(_tokenize(a), _tokenize(b)) for b in contents2] for a in contents1]
+        self.assertEqual(result["headings1"], ["PART 0", "PART 1", "PART 2"])
+        for row, expected_row in zip(result["scores"], expected):
+            for score, expected_score in zip(row, expected_row):
+                self.assertAlmostEqual(score, expected_score)
+        self.assertIn("error", self.analyzer.section_similarity_matrix("doc1", "missing"))
+
+    def test_current_document_is_found_outside_the_history(self):
+        """Test that the current document can be compared even when it is not in the history"""
+        self.analyzer.analysis_history = [dict(self.test_document, url="other_url")]
+
+        self.assertNotIn("error", self.analyzer.compare_documents("test_url", "other_url"))
+        self.assertNotIn("error", self.analyzer.compare_documents("other_url", "test_url"))
+        self.assertIn("key_themes", self.analyzer.analyze_document_content("test_url"))
+
+    def test_table_extraction_uses_cell_indices(self):
+        """Test that sparse and merged table cells land in the right positions"""
+        def cell(row, col, content, row_span=None, column_span=None):
+            return SimpleNamespace(row_index=row, column_index=col, content=content,
+                                   row_span=row_span, column_span=column_span)
+
+        table = SimpleNamespace(row_count=3, column_count=3, cells=[
+            cell(0, 0, "Header", column_span=3),
+            cell(1, 0, "Section"),
+            cell(1, 2, "Penalty", row_span=2),
+            cell(2, 1, "")
+        ])
+        tables = self.analyzer._extract_tables(SimpleNamespace(tables=[table]))
+
+        self.assertEqual(tables[0]["rows"], [
+            ["Header", "Header", "Header"],
+            ["Section", "", "Penalty"],
+            ["", "", "Penalty"]
+        ])
+
+    def test_structure_extraction_detects_headings(self):
+        """Test that numbered and accented headings start sections but page numbers do not"""
+        headings = ["ARTICLE 12 —", "PREMIÈRE LECTURE", "1. INTERPRETATION", "(1) DEFINITIONS",
+                    "SECTION 2 [REPEALED]", "WHAT IS AN AI SYSTEM?", "ŒUVRES"]
+        paragraphs = ["ARTICLE 12 —", "Organizations must comply.", "91102", "(1)",
+                      "PREMIÈRE LECTURE", "Texte du projet de loi."]
+        for heading in headings[2:]:
+            paragraphs += [heading, "Body."]
+        result = SimpleNamespace(paragraphs=[SimpleNamespace(content=p) for p in paragraphs])
+
+        sections = self.analyzer._extract_sections(result)
+
+        self.assertEqual(sections, [
+            {"heading": "ARTICLE 12 —", "content": "Organizations must comply.\n91102\n(1)"},
+            {"heading": "PREMIÈRE LECTURE", "content": "Texte du projet de loi."}
+        ] + [{"heading": heading, "content": "Body."} for heading in headings[2:]])
+
+    def test_analyze_documents_bounds_concurrency(self):
+        """Test that batch analysis keeps input order and respects the concurrency limit"""
+        active = 0
+        peak = 0
+
+        async def fake_analyze(url):
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return {"url": url}
+
+        urls = [f"doc_{i}" for i in range(10)]
+        with patch.object(self.analyzer, "analyze_document", side_effect=fake_analyze):
+            results = asyncio.run(self.analyzer.analyze_documents(urls, concurrency=3))
+
+        self.assertEqual([r["url"] for r in results], urls)
+        self.assertEqual(peak, 3)
+
+    def test_history_save_appends_json_lines(self):
+        """Test that saving appends only new analyses and loading restores them"""
+        self.analyzer.analysis_history = [self.test_document]
+        second = dict(self.test_document, url="second_url")
+
+        path = temp_path(self, "history.jsonl")
+        asyncio.run(self.analyzer.save_analysis_history(path))
+        self.analyzer.analysis_history.append(second)
+        self.analyzer.current_document = second
+        asyncio.run(self.analyzer.save_analysis_history(path))
+
+        self.assertEqual(logged_urls(path), ["test_url", "second_url"])
+
+        self.analyzer.analysis_history = []
+        self.analyzer.current_document = None
+        self.assertTrue(asyncio.run(self.analyzer.load_analysis_history(path))["success"])
+        self.assertEqual(len(self.analyzer.analysis_history), 2)
+        self.assertEqual(self.analyzer.current_document["url"], "second_url")
+
+    def test_set_history_path_appends_new_analyses(self):
+        """Test that analyses completed after set_history_path are appended to the log"""
+        self.analyzer.analysis_history = [self.test_document]
+        self.analyzer._run_layout_analysis = AsyncMock(return_value=dict(self.test_document, url="second_url"))
+
+        path = temp_path(self, "history.jsonl")
+        self.analyzer.set_history_path(path)
+        asyncio.run(self.analyzer.analyze_document("second_url", use_cache=False))
+
+        self.assertEqual(logged_urls(path), ["second_url"])
+
+    def test_save_after_set_history_path_writes_every_analysis(self):
+        """Test that the first save to a newly set history path writes the analyses already in memory"""
+        self.analyzer.analysis_history = [self.test_document]
+
+        path = temp_path(self, "history.jsonl")
+        self.analyzer.set_history_path(path)
+        asyncio.run(self.analyzer.save_analysis_history(path))
+        self.analyzer.analysis_history.append(dict(self.test_document, url="second_url"))
+        asyncio.run(self.analyzer.save_analysis_history(path))
+
+        self.assertEqual(logged_urls(path), ["test_url", "second_url"])
+
+    def test_reassigned_history_is_written_in_full(self):
+        """Test that saving after replacing the history rewrites the log with the new history"""
+        self.analyzer.analysis_history = [self.test_document, dict(self.test_document, url="second_url")]
+
+        path = temp_path(self, "history.jsonl")
+        asyncio.run(self.analyzer.save_analysis_history(path))
+        self.analyzer.analysis_history = [dict(self.test_document, url="third_url")]
+        asyncio.run(self.analyzer.save_analysis_history(path))
+
+        self.assertEqual(logged_urls(path), ["third_url"])
+
+    def test_failed_append_is_retried(self):
+        """Test that analyses whose append failed are written by the next append"""
+        self.analyzer.analysis_history = [self.test_document]
+
+        path = temp_path(self, "history.jsonl")
+        asyncio.run(self.analyzer.save_analysis_history(path))
+        self.analyzer.analysis_history.append(dict(self.test_document, url="second_url"))
+        with patch('document_analyzer.aiofiles.open', side_effect=OSError("disk full")):
+            asyncio.run(self.analyzer._append_unsaved_history())
+        asyncio.run(self.analyzer._append_unsaved_history())
+
+        self.assertEqual(logged_urls(path), ["test_url", "second_url"])
+
+    def test_history_gzip_round_trip(self):
+        """Test that a .gz history log is compressed, appended to and loaded back"""
+        self.analyzer.analysis_history = [self.test_document]
+        second = dict(self.test_document, url="second_url")
+
+        path = temp_path(self, "history.jsonl.gz")
+        asyncio.run(self.analyzer.save_analysis_history(path))
+        self.analyzer.analysis_history.append(second)
+        asyncio.run(self.analyzer.save_analysis_history(path))
+
+        self.assertEqual(logged_urls(path), ["test_url", "second_url"])
+
+        self.analyzer.analysis_history = []
+        self.assertTrue(asyncio.run(self.analyzer.load_analysis_history(path))["success"])
+        self.assertEqual([doc["url"] for doc in self.analyzer.analysis_history], ["test_url", "second_url"])
+
+    def test_legacy_history_is_migrated(self):
+        """Test that an indented single-document history file is loaded and rewritten as JSON Lines"""
+        path = temp_path(self, "history.json")
+        with open(path, "w") as f:
+            json.dump({
+                "current_document": self.test_document,
+                "analysis_history": [self.test_document]
+            }, f, indent=2)
+
+        self.assertTrue(asyncio.run(self.analyzer.load_analysis_history(path))["success"])
+        self.assertEqual(self.analyzer.analysis_history, [self.test_document])
+
+        with open(path) as f:
+            self.assertEqual([json.loads(line) for line in f], [self.test_document])
+
+    def test_analyze_document_reuses_cached_result(self):
+        """Test that a document with an unchanged version is not sent for analysis again"""
+        result = SimpleNamespace(content="BODY", paragraphs=[], tables=[], languages=[])
+        poller = Mock()
+        poller.result = AsyncMock(return_value=result)
+        client = Mock()
+        client.begin_analyze_document = AsyncMock(return_value=poller)
+        client.close = AsyncMock()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.analyzer.client = client
+            self.analyzer.cache_dir = tmp
+            with patch.object(self.analyzer, "_document_cache_key", AsyncMock(return_value="key")):
+                first = asyncio.run(self.analyzer.analyze_document("doc_url"))
+                second = asyncio.run(self.analyzer.analyze_document("doc_url"))
+                asyncio.run(self.analyzer.analyze_document("doc_url", use_cache=False))
+            asyncio.run(self.analyzer.close())
+
+            # A fresh analyzer finds the result in the on-disk cache
+            other = DocumentAnalyzer(self.endpoint, self.key, cache_dir=tmp)
+            other.client = client
+            with patch.object(other, "_document_cache_key", AsyncMock(return_value="key")):
+                third = asyncio.run(other.analyze_document("doc_url"))
+            asyncio.run(other.close())
+
+        self.assertEqual(client.begin_analyze_document.await_count, 2)
+        self.assertEqual(first, second)
+        self.assertEqual(first, third)
+        self.assertEqual(len(self.analyzer.analysis_history), 3)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,326 @@
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestTimeoutError, ServiceResponseTimeoutError
+from tenacity import wait_none
+
+# AI-Legal.py is not an importable module name, so load it from its path
+_spec = importlib.util.spec_from_file_location(
+    "legal_assistant", os.path.join(os.path.dirname(os.path.abspath(__file__)), "AI-Legal.py")
+)
+legal_assistant = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(legal_assistant)
+
+LegalAssistant = legal_assistant.LegalAssistant
+SemanticCache = legal_assistant.SemanticCache
+
+
+def completion(content, completion_tokens=0):
+    """A chat completion response with a single choice."""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+                           usage=SimpleNamespace(completion_tokens=completion_tokens))
+
+
+class TestConversationMemory(unittest.TestCase):
+    def setUp(self):
+        """Set up an assistant with a small memory window."""
+        self.assistant = LegalAssistant()
+        self.assistant.summary_prompt = "Summarize."
+
+    def test_window_keeps_only_recent_turns(self):
+        """Test that the memory window drops the oldest turns once it is full"""
+        self.assistant.window = legal_assistant.deque(maxlen=4)
+        self.assistant.summarize_every = 100
+
+        for turn in range(3):
+            self.assistant._remember(f"question {turn}", f"answer {turn}")
+
+        self.assertEqual([m["content"] for m in self.assistant.window],
+                         ["question 1", "answer 1", "question 2", "answer 2"])
+
+    def test_old_turns_are_merged_into_the_summary(self):
+        """Test that the oldest turns are summarized, removed from the window and added to the system message"""
+        self.assistant.summarize_every = 1
+        self.assistant.summary_batch_turns = 2
+        self.assistant.summary = "User is in Quebec."
+        self.assistant._complete = AsyncMock(return_value=completion(" User is in Quebec and asked about Law 25. "))
+
+        async def scenario():
+            for turn in range(3):
+                self.assistant._remember(f"question {turn}", f"answer {turn}")
+            await self.assistant._summary_task
+
+        asyncio.run(scenario())
+
+        prompt = self.assistant._complete.call_args.args[0][1]["content"]
+        self.assertIn("User is in Quebec.", prompt)
+        self.assertIn("User: question 0", prompt)
+        self.assertIn("Assistant: answer 1", prompt)
+        self.assertNotIn("question 2", prompt)
+        self.assertEqual(self.assistant.summary, "User is in Quebec and asked about Law 25.")
+        self.assertIn(self.assistant.summary, self.assistant._system_msg["content"])
+        self.assertEqual([m["content"] for m in self.assistant.window], ["question 2", "answer 2"])
+
+
+class TestSemanticCache(unittest.TestCase):
+    def test_lookup_respects_threshold_and_context(self):
+        """Test that only close enough embeddings in the same context are served from the cache"""
+        cache = SemanticCache(threshold=0.95)
+        cache.add([1.0, 0.0], "context", "cached answer")
+
+        self.assertEqual(cache.lookup([0.99, 0.05], "context"), "cached answer")
+        self.assertIsNone(cache.lookup([0.7, 0.7], "context"))
+        self.assertIsNone(cache.lookup([1.0, 0.0], "other context"))
+
+    def test_oldest_contexts_are_evicted(self):
+        """Test that the least recently added contexts are dropped once the cache is full"""
+        cache = SemanticCache(max_entries=2)
+        cache.add([1.0, 0.0], "first", "a")
+        cache.add([1.0, 0.0], "second", "b")
+        cache.add([1.0, 0.0], "third", "c")
+
+        self.assertIsNone(cache.lookup([1.0, 0.0], "first"))
+        self.assertEqual(cache.lookup([1.0, 0.0], "second"), "b")
+        self.assertEqual(cache.lookup([1.0, 0.0], "third"), "c")
+
+    def test_oldest_answers_in_a_single_context_are_evicted(self):
+        """Test that a context holding more answers than the cache allows keeps only the newest"""
+        cache = SemanticCache(max_entries=3)
+        for idx in range(10):
+            cache.add([math.cos(idx), math.sin(idx)], "context", f"answer {idx}")
+
+        vectors, responses = cache._buckets["context"]
+        self.assertEqual(responses, ["answer 7", "answer 8", "answer 9"])
+        self.assertEqual(len(vectors), 3)
+        self.assertEqual(cache._size, 3)
+        self.assertIsNone(cache.lookup([math.cos(0), math.sin(0)], "context"))
+        self.assertEqual(cache.lookup([math.cos(9), math.sin(9)], "context"), "answer 9")
+
+
+class FakeStream:
+    """A streamed chat completion that yields its answer in two pieces."""
+
+    def __init__(self, content):
+        half = len(content) // 2
+        self.updates = [
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+            for piece in (content[:half], content[half:])
+        ]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def __aiter__(self):
+        for update in self.updates:
+            yield update
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        """Set up an assistant whose embeddings place paraphrases close together."""
+        self.assistant = LegalAssistant()
+        vectors = {
+            "What is the EU AI Act?": [1.0, 0.0, 0.0],
+            "What's the EU AI Act?": [0.99, 0.05, 0.0],
+            "What penalties apply?": [0.0, 1.0, 0.0],
+            "Which penalties apply?": [0.05, 0.99, 0.0],
+            "What is the GDPR?": [0.0, 0.0, 1.0],
+        }
+
+        async def embed(model, input):
+            return SimpleNamespace(data=[SimpleNamespace(embedding=vectors[input[0]])])
+
+        self.assistant.embeddings_client = Mock(embed=AsyncMock(side_effect=embed))
+        def complete(messages, **kwargs):
+            # Answer the new question in the light of the one before it
+            questions = [m["content"] for m in messages if m["role"] == "user"]
+            return FakeStream(f"answer to {' '.join(questions[-2:])}")
+
+        self.assistant._complete = AsyncMock(side_effect=complete)
+
+    def ask(self, question):
+        return asyncio.run(self.assistant.get_response(question))
+
+    def test_repeated_and_paraphrased_questions_are_served_from_the_cache(self):
+        """Test that a question or its paraphrase asked again after the same question is not completed again"""
+        self.ask("What is the EU AI Act?")
+        first = self.ask("What penalties apply?")
+        self.ask("What is the EU AI Act?")
+
+        self.assertEqual(self.ask("Which penalties apply?"), first)
+        self.assertEqual(self.assistant._complete.call_count, 3)
+        self.assertEqual(len(self.assistant.window), 8)
+
+    def test_elliptical_questions_are_not_answered_from_another_topic(self):
+        """Test that a question asked again after a different question goes to the model"""
+        self.ask("What is the EU AI Act?")
+        self.ask("What penalties apply?")
+        self.ask("What is the GDPR?")
+        answer = self.ask("What penalties apply?")
+
+        self.assertEqual(self.assistant._complete.call_count, 4)
+        self.assertIn("GDPR", answer)
+
+    def test_cache_is_scoped_to_the_summary(self):
+        """Test that a changed conversation summary does not reuse earlier answers"""
+        self.ask("What is the EU AI Act?")
+        self.assistant.window.clear()
+        self.ask("What is the EU AI Act?")
+        self.assertEqual(self.assistant._complete.call_count, 1)
+
+        self.assistant.window.clear()
+        self.assistant.summary = "User is a provider of high-risk systems in France."
+        self.ask("What is the EU AI Act?")
+        self.assertEqual(self.assistant._complete.call_count, 2)
+
+
+class TestRetries(unittest.TestCase):
+    def test_transient_errors(self):
+        """Test that throttling, server errors and azure-core timeouts are retried and other errors are not"""
+        def http_error(status):
+            return HttpResponseError(response=Mock(status_code=status, reason="", headers={}))
+
+        self.assertTrue(legal_assistant._is_transient_error(http_error(429)))
+        self.assertTrue(legal_assistant._is_transient_error(http_error(503)))
+        self.assertTrue(legal_assistant._is_transient_error(ServiceRequestTimeoutError("connect timed out")))
+        self.assertTrue(legal_assistant._is_transient_error(ServiceResponseTimeoutError("read timed out")))
+        self.assertFalse(legal_assistant._is_transient_error(http_error(400)))
+        self.assertFalse(legal_assistant._is_transient_error(ValueError("bad input")))
+
+    def test_complete_retries_three_times(self):
+        """Test that a completion is attempted at most three times"""
+        assistant = LegalAssistant()
+        assistant.chat_client = Mock(complete=AsyncMock(side_effect=[
+            ServiceResponseTimeoutError("read timed out"), ServiceResponseTimeoutError("read timed out"), "answer"
+        ]))
+
+        with patch.object(legal_assistant, "wait_exponential_jitter", return_value=wait_none()):
+            self.assertEqual(asyncio.run(assistant._complete([])), "answer")
+
+            assistant.chat_client.complete = AsyncMock(side_effect=ServiceResponseTimeoutError("read timed out"))
+            with self.assertRaises(ServiceResponseTimeoutError):
+                asyncio.run(assistant._complete([]))
+        self.assertEqual(assistant.chat_client.complete.call_count, 3)
+
+    def test_clients_disable_sdk_retries_and_set_timeouts(self):
+        """Test that the clients are created without the SDK's own retry policy and with short timeouts"""
+        assistant = LegalAssistant()
+        env = {"AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com", "AZURE_OPENAI_KEY": "key"}
+
+        async def scenario():
+            self.assertTrue(await assistant.initialize())
+            await assistant._http.close()
+
+        with patch.dict(os.environ, env), \
+                patch.object(legal_assistant, "ChatCompletionsClient") as chat_client, \
+                patch.object(legal_assistant, "EmbeddingsClient") as embeddings_client, \
+                patch.object(legal_assistant.aiofiles, "open", AsyncMock()), \
+                patch.object(LegalAssistant, "_prewarm_connection", AsyncMock()):
+            asyncio.run(scenario())
+
+        for client in (chat_client, embeddings_client):
+            self.assertEqual(client.call_args.kwargs["retry_total"], 0)
+            connection_config = client.call_args.kwargs["transport"].connection_config
+            self.assertEqual(connection_config.timeout, 10)
+            self.assertEqual(connection_config.read_timeout, 120)
+
+
+class TestConcurrentRequests(unittest.TestCase):
+    def setUp(self):
+        """Set up an assistant whose completions take a set time on a simulated clock."""
+        self.assistant = LegalAssistant()
+        self.clock = 0.0
+        self.latencies = {"q1": 1.0, "q2": 2.0, "q3": 3.0, "q4": 4.0}
+
+        async def complete(messages, **kwargs):
+            question = messages[-1]["content"]
+            if question not in self.latencies:
+                raise ValueError("bad request")
+            await asyncio.sleep(self.latencies[question] / 1000)
+            self.clock += self.latencies[question]
+            return completion(f"answer to {question}", completion_tokens=10)
+
+        self.assistant._complete = AsyncMock(side_effect=complete)
+
+    def test_get_responses_keeps_input_order(self):
+        """Test that answers are returned in question order and failed questions are None"""
+        responses = asyncio.run(self.assistant.get_responses(["q4", "bad", "q1", "q3"]))
+
+        self.assertEqual(responses, ["answer to q4", None, "answer to q1", "answer to q3"])
+        self.assertEqual(self.assistant.chat_history, [])
+
+    def test_benchmark_reports_latency_and_throughput(self):
+        """Test that the benchmark reports failures, latency percentiles and completion tokens per second"""
+        self.assistant.max_concurrency = 1
+        fake_time = SimpleNamespace(perf_counter=lambda: self.clock)
+
+        with patch.object(legal_assistant, "time", fake_time):
+            result = asyncio.run(self.assistant.benchmark(["q1", "q2", "q3", "q4", "bad"]))
+
+        self.assertEqual(result["requests"], 5)
+        self.assertEqual(result["failures"], 1)
+        self.assertEqual(result["unique_ratio"], 1.0)
+        self.assertEqual(result["elapsed_seconds"], 10.0)
+        self.assertEqual(result["p50_latency_seconds"], 2.5)
+        self.assertEqual(result["p95_latency_seconds"], 4.0)
+        self.assertEqual(result["completion_tokens_per_second"], 4.0)
+
+    def test_benchmark_rejects_repeated_queries(self):
+        """Test that a benchmark with too few distinct queries, or none at all, is refused before any request"""
+        with self.assertRaisesRegex(ValueError, "diversity too low"):
+            asyncio.run(self.assistant.benchmark(["q1", "q1", "q2"]))
+        self.assertEqual(asyncio.run(self.assistant.benchmark(["q1", "q1", "q2"], min_unique_ratio=0.5))["requests"], 3)
+        with self.assertRaises(ValueError):
+            asyncio.run(self.assistant.benchmark([]))
+        self.assertEqual(self.assistant._complete.call_count, 3)
+
+
+class TestBatch(unittest.TestCase):
+    def test_fetch_batch_returns_answers_in_question_order(self):
+        """Test that batch output is reordered by question and failed questions are None"""
+        assistant = LegalAssistant()
+        assistant.batch_history = [{"batch_id": "batch-1", "questions": ["q0", "q1", "q2"], "status": "validating"}]
+
+        def output_line(idx, content=None):
+            body = {"choices": [{"message": {"content": content}}]} if content else None
+            return json.dumps({"custom_id": f"question-{idx}", "response": body and {"body": body}})
+
+        client = Mock()
+        client.batches.retrieve = AsyncMock(return_value=SimpleNamespace(status="completed", output_file_id="file-1"))
+        client.files.content = AsyncMock(return_value=SimpleNamespace(
+            text="\n".join([output_line(2, "third"), output_line(1), output_line(0, "first")])
+        ))
+        assistant._batch_client = client
+
+        result = asyncio.run(assistant.fetch_batch("batch-1"))
+
+        self.assertEqual(result["responses"], ["first", None, "third"])
+        self.assertEqual(assistant.batch_history[0]["status"], "completed")
+
+    def test_batch_client_uses_the_resource_endpoint(self):
+        """Test that the batch client is given the resource URL rather than a deployment URL"""
+        env = {
+            "AZURE_OPENAI_ENDPOINT": "https://example.openai.azure.com/openai/deployments/legal-assistant",
+            "AZURE_OPENAI_KEY": "key",
+        }
+        with patch.dict(os.environ, env), patch.object(legal_assistant, "AsyncAzureOpenAI") as client:
+            os.environ.pop("AZURE_OPENAI_RESOURCE_ENDPOINT", None)
+            LegalAssistant()._get_batch_client()
+            self.assertEqual(client.call_args.kwargs["azure_endpoint"], "https://example.openai.azure.com")
+
+            os.environ["AZURE_OPENAI_RESOURCE_ENDPOINT"] = "https://resource.openai.azure.com"
+            LegalAssistant()._get_batch_client()
+            self.assertEqual(client.call_args.kwargs["azure_endpoint"], "https://resource.openai.azure.com")
+
+
+if __name__ == "__main__":
+    unittest.main()